@@ -4,11 +4,24 @@ import sys
 # Add the project root to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import contextvars
+import hashlib
 import json
+import re
+import threading
+import time
+import heapq
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.documents import Document
 from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
+from src.calibration import CALIBRATION_FILE, load_calibration
+from src.embedding_server import load_embeddings
+from src.generations import current_generation_dir, list_shards
+from src.ivfpq import IVFPQStore, is_ivfpq_generation
+from src.profiling import annotate, profile_run, stage
 
 
 # Load environment variables from .env file
@@ -19,41 +32,401 @@ llm = ChatGoogleGenerativeAI(
     temperature=0
 )
 
+# --- Model routing ---
+# Each LLM call is made for a "route" (the classifier or an intent) and goes to that
+# route's model tier. Override with JSON in RAG_MODEL_TIERS / RAG_MODEL_ROUTES.
+MODEL_TIERS = {
+    "fast": "gemini-2.5-flash-lite",
+    "standard": "gemini-2.5-flash",
+}
+MODEL_ROUTES = {
+    "classify": "fast",
+    "greeting": "fast",
+    "conversation": "standard",
+    "rag": "standard",
+    "summarize": "standard",
+    "format_slack": "fast",
+    "format_email": "standard",
+}
+MODEL_TIERS.update(json.loads(os.getenv("RAG_MODEL_TIERS", "{}")))
+MODEL_ROUTES.update(json.loads(os.getenv("RAG_MODEL_ROUTES", "{}")))
+# Catch a misconfigured routing table at startup rather than as a per-request error
+_unknown_tiers = sorted({tier for tier in MODEL_ROUTES.values() if tier not in MODEL_TIERS} | ({"standard"} - set(MODEL_TIERS)))
+if _unknown_tiers:
+    raise ValueError(f"Unknown model tier(s) {_unknown_tiers} in RAG_MODEL_ROUTES/RAG_MODEL_TIERS; known tiers: {sorted(MODEL_TIERS)}")
+ROUTING_LOG = os.getenv("RAG_ROUTING_LOG", "")  # JSONL file of per-request routing records
+
+_llms = {llm.model.removeprefix("models/"): llm}
+_llms_lock = threading.Lock()
+_request_calls = contextvars.ContextVar("rag_request_calls", default=None)
+_routing_stats = {}
+_routing_stats_lock = threading.Lock()
+_routing_log_lock = threading.Lock()  # serializes log appends without blocking the stats
+
+# --- Per-session working sets ---
+# The last answer of each session plus the chunks and sources it came from, so
+# follow-ups like "now format that as an email" skip retrieval entirely. Working sets are
+# per process: with several server processes, a session's requests must reach the same one.
+SESSION_TTL = float(os.getenv("RAG_SESSION_TTL", "3600"))  # seconds of inactivity before a session is dropped
+MAX_SESSIONS = int(os.getenv("RAG_MAX_SESSIONS", "1000"))
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+_request_retrieval = contextvars.ContextVar("rag_request_retrieval", default=None)
+# Only explicit references to the last answer: a bare "this"/"it" ("summarize this document")
+# is far more often a new request than a follow-up
+FOLLOWUP_PATTERN = re.compile(
+    r"\b((that|this|the|your|previous|last) (answer|response|reply)|the above|(what|everything) you (just )?(said|wrote))\b"
+)
+
+# Greetings and thanks that get a templated reply without any LLM call
+FAST_PATH_REPLIES = [
+    (re.compile(r"^(hi|hello|hey|hiya|yo|greetings|good (morning|afternoon|evening))( there)?$"),
+     "Hello! Ask me anything about your documents — I can answer questions, summarize, or format content for Slack or email."),
+    (re.compile(r"^(thanks|thank you|thx|ty|cheers)( (so|very) much)?( a lot)?$"),
+     "You're welcome! Let me know if there's anything else you need from your documents."),
+    (re.compile(r"^(bye|goodbye|see you|see ya)$"),
+     "Goodbye! Come back any time you have questions about your documents."),
+]
+
 DB_DIR = os.path.join(os.getcwd(), "chroma_db")
 VECTOR_MODEL = "all-MiniLM-L6-v2"
-RELEVANCE_THRESHOLD = 1.2  # ChromaDB L2 distance — lower = more similar
+RELEVANCE_THRESHOLD = 1.2  # ChromaDB L2 distance — lower = more similar; used where a shard has no calibration
 
 # Instantiate embeddings (DB will be loaded when needed)
-embeddings = HuggingFaceEmbeddings(model_name=VECTOR_MODEL)
-db = None  # Will be initialized after document ingestion
+embeddings = load_embeddings(VECTOR_MODEL)  # shared embedding server if RAG_EMBEDDING_SOCKET is set
+shard_dbs = {}  # shard name -> (generation dir the store was opened from, store)
+_shard_dbs_lock = threading.Lock()
+_thresholds = {}  # generation dir -> (calibration file mtime, threshold)
+STORE_RETIRE_GRACE = 60  # seconds a replaced store stays open for queries already using it
+_retired_stores = {}  # generation dir -> (retired at, store), oldest first
+
+# --- Sharded retrieval ---
+# Every shard is searched in parallel and the results merged into one global top-k.
+# Per-shard latency is tracked so a straggling shard shows up in get_shard_stats().
+SHARD_THREADS = int(os.getenv("RAG_SHARD_THREADS", "8"))
+_shard_pool = ThreadPoolExecutor(max_workers=SHARD_THREADS, thread_name_prefix="rag-shard")
+_request_shards = contextvars.ContextVar("rag_request_shards", default=None)
+_shard_stats = {}
+_shard_stats_lock = threading.Lock()
+
+
+def _close_store(store):
+    """Release a store that is no longer served. chromadb caches one client system per
+    path for the life of the process, so a replaced Chroma store is evicted from that
+    cache and stopped; otherwise every old generation would stay loaded."""
+    if isinstance(store, IVFPQStore):
+        store.close()
+        return
+    client = store._client
+    system = client._system
+    type(client)._identifier_to_system.pop(client._identifier, None)
+    system.stop()
+
+
+def _retire_store(live_dir: str, store):
+    """Queue a replaced store for closing once in-flight queries have had time to finish."""
+    _retired_stores[live_dir] = (time.monotonic(), store)
+
+
+def _close_retired_stores():
+    now = time.monotonic()
+    live_dirs = {live_dir for live_dir, _ in shard_dbs.values()}
+    for live_dir, (retired_at, store) in list(_retired_stores.items()):
+        if now - retired_at < STORE_RETIRE_GRACE:
+            break
+        del _retired_stores[live_dir]
+        # chromadb shares one system per path: never stop one a live store still uses
+        if live_dir in live_dirs:
+            continue
+        try:
+            _close_store(store)
+        except Exception as e:
+            print(f"Failed to close retired vector store: {e}")
+
+
+def _get_shard_dbs(shards: list = None) -> dict:
+    """Return {shard name: store} for the published generation of each shard (or the given subset).
+    Reopens a shard's store when ingestion has published a newer generation (or a rollback
+    has re-published an older one), so running processes never need a restart. Stores of
+    replaced generations and unpublished shards are closed after STORE_RETIRE_GRACE seconds."""
+    stores = {}
+    with _shard_dbs_lock:
+        _close_retired_stores()
+        published = list_shards(DB_DIR)
+        for name in [name for name in shard_dbs if name not in published]:
+            _retire_store(*shard_dbs.pop(name))
+        for name, root in published.items():
+            if shards is not None and name not in shards:
+                continue
+            live_dir = current_generation_dir(root)
+            cached = shard_dbs.get(name)
+            if cached is None or cached[0] != live_dir:
+                if cached is not None:
+                    _retire_store(*cached)
+                if live_dir in _retired_stores:
+                    # Rolled back to a generation still in its grace period: serve it again
+                    store = _retired_stores.pop(live_dir)[1]
+                elif is_ivfpq_generation(live_dir):
+                    store = IVFPQStore(persist_directory=live_dir, embedding_function=embeddings)
+                else:
+                    store = Chroma(persist_directory=live_dir, embedding_function=embeddings)
+                cached = shard_dbs[name] = (live_dir, store)
+            stores[name] = cached[1]
+    return stores
+
+
+def get_shard_threshold(shard: str) -> float:
+    """The shard's calibrated relevance threshold, or RELEVANCE_THRESHOLD if it has none.
+    Re-read when `python -m src.calibration` rewrites the calibration of the live generation."""
+    cached = shard_dbs.get(shard)
+    if cached is None:
+        return RELEVANCE_THRESHOLD
+    live_dir = cached[0]
+    try:
+        mtime = os.stat(os.path.join(live_dir, CALIBRATION_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return RELEVANCE_THRESHOLD
+    entry = _thresholds.get(live_dir)
+    if entry is None or entry[0] != mtime:
+        calibration = load_calibration(live_dir) or {}
+        entry = _thresholds[live_dir] = (mtime, calibration.get("threshold", RELEVANCE_THRESHOLD))
+    return entry[1]
+
+
+def _record_shard_latency(shard: str, seconds: float):
+    with _shard_stats_lock:
+        entry = _shard_stats.setdefault(shard, {"searches": 0, "seconds": 0.0, "max_seconds": 0.0})
+        entry["searches"] += 1
+        entry["seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+        entry["last_seconds"] = seconds
+
+
+def get_shard_stats() -> dict:
+    """Per-shard search count, mean/max/last latency and relevance threshold."""
+    with _shard_stats_lock:
+        return {
+            shard: dict(entry, mean_seconds=round(entry["seconds"] / entry["searches"], 4),
+                        threshold=round(get_shard_threshold(shard), 4))
+            for shard, entry in _shard_stats.items()
+        }
+
+
+def _search_by_vectors(vector_db, query_vectors: list, k: int) -> list:
+    """One multi-query, distances-only lookup against the store; one [(id, score), ...] per vector.
+    Documents are fetched afterwards, and only for hits inside the relevance threshold."""
+    if isinstance(vector_db, IVFPQStore):
+        return vector_db.search_ids_by_vectors(query_vectors, k)
+    results = vector_db._collection.query(
+        query_embeddings=query_vectors,
+        n_results=k,
+        include=["distances"],
+    )
+    return [list(zip(ids, scores)) for ids, scores in zip(results["ids"], results["distances"])]
+
+
+def _fetch_documents(vector_db, ids: list) -> dict:
+    """Load the given chunks from the store; returns {id: Document}."""
+    if isinstance(vector_db, IVFPQStore):
+        return dict(zip(ids, vector_db.get_documents(ids)))
+    results = vector_db._collection.get(ids=list(ids), include=["documents", "metadatas"])
+    return {
+        id_: Document(page_content=text, metadata=metadata or {})
+        for id_, text, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+    }
+
+
+def _pack_results(relevant: list) -> tuple:
+    """Turn relevant docs into (content, sources, is_relevant)."""
+    if not relevant:
+        return "", "", False
 
+    # Deduplicated chunks carry every source of their cluster in "sources"
+    sources = ", ".join(list(set(
+        source
+        for doc in relevant
+        for source in doc.metadata.get("sources", doc.metadata.get("source", "unknown")).split(", ")
+    )))
+    content = " ".join([doc.page_content for doc in relevant])
+    return content, sources, True
 
-def _get_db():
-    """Initialize and return the ChromaDB instance."""
-    global db
-    if db is None:
-        db = Chroma(persist_directory=DB_DIR, embedding_function=embeddings)
-    return db
 
+def _timed_search(shard: str, vector_db, query_vectors: list, k: int) -> list:
+    start = time.perf_counter()
+    with stage(f"shard:{shard}"):
+        results = _search_by_vectors(vector_db, query_vectors, k)
+    _record_shard_latency(shard, time.perf_counter() - start)
+    return [[(shard, id_, score) for id_, score in hits] for hits in results]
 
-def _retrieve_docs(query: str, k: int = 5) -> tuple:
-    """Retrieve docs with relevance scores. Returns (content, sources, is_relevant).
-    Uses similarity_search_with_score to check if results are actually relevant."""
-    vector_db = _get_db()
-    results = vector_db.similarity_search_with_score(query, k=k)
 
-    if not results:
-        return "", "", False
+def _search_shards(stores: dict, query_vectors: list, k: int) -> list:
+    """Fan the lookup out to every shard in parallel and merge into a global top-k per query.
+    Hits are (shard, id, score)."""
+    if len(stores) == 1:
+        shard, vector_db = next(iter(stores.items()))
+        return _timed_search(shard, vector_db, query_vectors, k)
+    futures = [
+        _shard_pool.submit(contextvars.copy_context().run, _timed_search, shard, vector_db, query_vectors, k)
+        for shard, vector_db in stores.items()
+    ]
+    per_shard = [future.result() for future in futures]
+    return [
+        heapq.nsmallest(k, (hit for shard_results in per_shard for hit in shard_results[i]), key=lambda hit: hit[2])
+        for i in range(len(query_vectors))
+    ]
 
-    # Filter to only relevant chunks (L2 distance below threshold)
-    relevant = [(doc, score) for doc, score in results if score < RELEVANCE_THRESHOLD]
 
-    if not relevant:
-        return "", "", False
+def retrieve_docs_batch(queries: list, k=5, thresholds=None, shards: list = None) -> list:
+    """Retrieve for many queries at once. Returns one (content, sources, is_relevant) per query.
+    `k` and `thresholds` may be a single value or a per-query list. All queries are embedded
+    in one forward pass and looked up with one multi-query call per shard. `shards` limits
+    the search to a subset of shards (default: the request's routed shards, else all).
+    After the global merge each hit is checked against its shard's calibrated threshold
+    (or `thresholds`, if given), and chunk text is only loaded for hits that pass — a
+    query with nothing in range returns without touching the document store."""
+    if not queries:
+        return []
+    ks = k if isinstance(k, (list, tuple)) else [k] * len(queries)
+    if thresholds is not None and not isinstance(thresholds, (list, tuple)):
+        thresholds = [thresholds] * len(queries)
+
+    with stage("retrieve"):
+        stores = _get_shard_dbs(shards if shards is not None else _request_shards.get())
+        if not stores:
+            return [("", "", False)] * len(queries)
+        query_vectors = embeddings.embed_documents(list(queries))
+        results = _search_shards(stores, query_vectors, max(ks))
+
+        shard_thresholds = {shard: get_shard_threshold(shard) for shard in stores}
+        relevant_hits = [
+            [
+                (shard, id_) for shard, id_, score in hits[:query_k]
+                if score < (shard_thresholds[shard] if thresholds is None else thresholds[i])
+            ]
+            for i, (hits, query_k) in enumerate(zip(results, ks))
+        ]
+        wanted = {}
+        for hits in relevant_hits:
+            for shard, id_ in hits:
+                wanted.setdefault(shard, {})[id_] = None
+        if not wanted:
+            return [("", "", False)] * len(queries)
+
+        with stage("fetch"):
+            docs = {
+                (shard, id_): doc
+                for shard, ids in wanted.items()
+                for id_, doc in _fetch_documents(stores[shard], list(ids)).items()
+            }
+    return [_pack_results([docs[hit] for hit in hits if hit in docs]) for hits in relevant_hits]
 
-    sources = ", ".join(list(set([doc.metadata.get("source", "unknown") for doc, _ in relevant])))
-    content = " ".join([doc.page_content for doc, _ in relevant])
-    return content, sources, True
+
+def _retrieve_docs(query: str, k: int = 5) -> tuple:
+    """Retrieve docs with relevance scores. Returns (content, sources, is_relevant).
+    Uses similarity scores to check if results are actually relevant."""
+    content, sources, is_relevant = retrieve_docs_batch([query], k)[0]
+    retrieval = _request_retrieval.get()
+    if retrieval is not None:
+        retrieval.update(content=content, sources=sources)
+    return content, sources, is_relevant
+
+
+class WorkingSet:
+    """What a session's follow-ups operate on: the last answer and the chunks and sources behind it."""
+
+    def __init__(self):
+        self.answer = None
+        self.content = ""
+        self.sources = None
+        self.updated = time.time()
+
+
+def _get_working_set(session_id: str) -> WorkingSet:
+    """Return the session's working set, creating it; expired and least-recent sessions are evicted."""
+    now = time.time()
+    with _sessions_lock:
+        while _sessions:
+            oldest_id, oldest = next(iter(_sessions.items()))
+            if len(_sessions) < MAX_SESSIONS and now - oldest.updated < SESSION_TTL:
+                break
+            del _sessions[oldest_id]
+        working_set = _sessions.pop(session_id, None) or WorkingSet()
+        working_set.updated = now
+        _sessions[session_id] = working_set
+        return working_set
+
+
+def clear_session(session_id: str):
+    """Forget a session's working set (e.g. when the user clears the conversation)."""
+    with _sessions_lock:
+        _sessions.pop(session_id, None)
+
+
+def _get_llm(route: str):
+    """Return (llm, model name) for a route, creating one client per model on first use."""
+    model_name = MODEL_TIERS[MODEL_ROUTES.get(route, "standard")]
+    with _llms_lock:
+        if model_name not in _llms:
+            _llms[model_name] = ChatGoogleGenerativeAI(model=model_name, temperature=0)
+        return _llms[model_name], model_name
+
+
+def _invoke(prompt, route: str):
+    """Invoke the route's model and record latency and token usage for the current request."""
+    route_llm, model_name = _get_llm(route)
+    start = time.perf_counter()
+    with stage(f"llm:{route}"):
+        response = route_llm.invoke(prompt)
+    usage = getattr(response, "usage_metadata", None) or {}
+    calls = _request_calls.get()
+    if calls is not None:
+        calls.append({
+            "route": route,
+            "model": model_name,
+            "seconds": round(time.perf_counter() - start, 4),
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+        })
+    return response
+
+
+def _fast_path_reply(query: str):
+    """Templated reply for bare greetings/thanks, or None if the query needs the LLM."""
+    normalized = re.sub(r"[^\w\s]", "", query.lower()).strip()
+    normalized = re.sub(r"\s+", " ", normalized)
+    for pattern, reply in FAST_PATH_REPLIES:
+        if pattern.match(normalized):
+            return reply
+    return None
+
+
+def _record_routing(intent: str, seconds: float, calls: list):
+    """Aggregate one request into the per-intent routing stats (and the JSONL log if enabled)."""
+    with _routing_stats_lock:
+        entry = _routing_stats.setdefault(intent, {
+            "requests": 0, "seconds": 0.0, "llm_calls": 0,
+            "input_tokens": 0, "output_tokens": 0, "models": {},
+        })
+        entry["requests"] += 1
+        entry["seconds"] += seconds
+        entry["llm_calls"] += len(calls)
+        for call in calls:
+            entry["input_tokens"] += call["input_tokens"]
+            entry["output_tokens"] += call["output_tokens"]
+            entry["models"][call["model"]] = entry["models"].get(call["model"], 0) + 1
+    if ROUTING_LOG:
+        record = json.dumps({"ts": time.time(), "intent": intent, "seconds": round(seconds, 4), "calls": calls}) + "\n"
+        with _routing_log_lock, open(ROUTING_LOG, "a") as f:
+            f.write(record)
+
+
+def get_routing_stats() -> dict:
+    """Per-intent request count, mean latency, LLM calls, token spend and model choices."""
+    with _routing_stats_lock:
+        return {
+            intent: dict(entry, models=dict(entry["models"]), mean_seconds=round(entry["seconds"] / entry["requests"], 4))
+            for intent, entry in _routing_stats.items()
+        }
 
 
 # --- Intent Classification using LLM ---
@@ -82,10 +455,11 @@ Categories:
 
 User query: "{query}"
 
-Reply as JSON: {{"intent": "<category>", "length": "default"}}
-For summarize, set length to "long" if user asks for detailed/long summary, otherwise "default"."""
+Reply as JSON: {{"intent": "<category>", "length": "default", "followup": false}}
+For summarize, set length to "long" if user asks for detailed/long summary, otherwise "default".
+Set followup to true only if the user wants to summarize or reformat the previous assistant answer (e.g. "format that as an email", "summarize it")."""
 
-    response = llm.invoke(classification_prompt)
+    response = _invoke(classification_prompt, "classify")
     response_text = response.content.strip()
 
     # Parse the JSON response
@@ -97,6 +471,8 @@ For summarize, set length to "long" if user asks for detailed/long summary, othe
                 response_text = response_text[4:]
             response_text = response_text.strip()
         result = json.loads(response_text)
+        # A parsed reply without the key is not a follow-up; the regex is only for unparseable replies
+        result.setdefault("followup", False)
         return result
     except (json.JSONDecodeError, IndexError):
         # Fallback: extract intent from text
@@ -129,7 +505,7 @@ def summarize_content(content: str, length: str = "default") -> dict:
         {"role": "system", "content": "You are a summarization expert."},
         {"role": "user", "content": summary_prompt}
     ]
-    response = llm.invoke(messages)
+    response = _invoke(messages, "summarize")
     return {"output": response.content, "type": "summarizer"}
 
 
@@ -142,7 +518,7 @@ def format_response(text: str, format_type: str) -> dict:
         {"role": "system", "content": "You are a content formatter."},
         {"role": "user", "content": format_prompt}
     ]
-    response = llm.invoke(messages)
+    response = _invoke(messages, f"format_{format_type}")
     return {"output": response.content, "type": "formatter"}
 
 
@@ -171,7 +547,7 @@ Instructions:
 
 Answer:""".format(context=content, user_query=query)
 
-    response = llm.invoke(prompt)
+    response = _invoke(prompt, "rag")
     return response.content, "rag", sources
 
 
@@ -198,7 +574,27 @@ def handle_format(query: str, format_type: str) -> tuple:
     return format_result["output"], "formatter", sources
 
 
-def handle_conversation(query: str, chat_history: list = None) -> tuple:
+def handle_followup(intent: str, length: str, working_set: WorkingSet) -> tuple:
+    """Summarize or format the session's last answer directly, without retrieving again.
+    A detailed summary also draws on the chunks the answer was built from."""
+    if intent == "summarize":
+        text = working_set.answer
+        if length == "long" and working_set.content:
+            text = f"{working_set.answer}\n\nSupporting material:\n{working_set.content}"
+        summary_result = summarize_content(text, length)
+        return summary_result["output"], "summarizer", working_set.sources
+    format_result = format_response(working_set.answer, intent.split("_", 1)[1])
+    return format_result["output"], "formatter", working_set.sources
+
+
+def _is_followup(query: str, intent_result: dict) -> bool:
+    if "followup" in intent_result:
+        return bool(intent_result["followup"])
+    # Classifier reply was not parseable JSON: fall back to spotting references to the last answer
+    return bool(FOLLOWUP_PATTERN.search(query.lower()))
+
+
+def handle_conversation(query: str, chat_history: list = None, route: str = "conversation") -> tuple:
     """Handle general conversational queries using LLM directly."""
     history_context = ""
     if chat_history:
@@ -211,54 +607,109 @@ def handle_conversation(query: str, chat_history: list = None) -> tuple:
         history_context = "\nConversation so far:\n" + "\n".join(history_lines) + "\n"
 
     conversation_prompt = f"You are a helpful AI assistant for a document Q&A system.{history_context}\nUser: {query}\n\nRespond naturally and concisely."
-    response = llm.invoke(conversation_prompt)
+    response = _invoke(conversation_prompt, route)
     return response.content, "conversational", None
 
 
 # --- Main Query Processor ---
-def process_query(query: str, chat_history: list = None) -> dict:
+def process_query(query: str, chat_history: list = None, session_id: str = None, shards: list = None) -> dict:
     """
     Process the query using LLM-based intent classification.
+    Bare greetings and thanks are answered from templates without any LLM call.
+    With a session_id, summarize/format follow-ups reuse the session's last answer.
+    `shards` routes retrieval to a subset of index shards (default: all).
     """
+    start = time.perf_counter()
+    fast_reply = _fast_path_reply(query)
+    if fast_reply is not None:
+        annotate(intent="greeting")
+        _record_routing("greeting", time.perf_counter() - start, [])
+        return {"output": fast_reply, "type": "conversational"}
+
+    calls = []
+    working_set = _get_working_set(session_id) if session_id else None
+    token = _request_calls.set(calls)
+    shards_token = _request_shards.set(shards)
+    try:
+        result, intent = _classify_and_handle(query, chat_history, working_set)
+    finally:
+        _request_shards.reset(shards_token)
+        _request_calls.reset(token)
+    _record_routing(intent, time.perf_counter() - start, calls)
+    return result
+
+
+def _classify_and_handle(query: str, chat_history: list = None, working_set: WorkingSet = None) -> tuple:
+    """Classify the query and run its handler. Returns (result dict, intent)."""
     # Classify intent using LLM
-    intent_result = classify_intent(query, chat_history)
+    with stage("classify"):
+        intent_result = classify_intent(query, chat_history)
     intent = intent_result.get("intent", "rag")
     length = intent_result.get("length", "default")
+    annotate(intent=intent)
+
+    followup = (
+        working_set is not None
+        and working_set.answer
+        and intent in ("summarize", "format_slack", "format_email")
+        and _is_followup(query, intent_result)
+    )
+    retrieval = {}
+    token = _request_retrieval.set(retrieval)
 
     # Route to the appropriate handler
-    if intent == "greeting":
-        output, response_type, source = handle_conversation(query, chat_history)
-    elif intent == "summarize":
-        output, response_type, source = handle_summarize(query, length)
-    elif intent == "format_slack":
-        output, response_type, source = handle_format(query, "slack")
-    elif intent == "format_email":
-        output, response_type, source = handle_format(query, "email")
-    elif intent == "rag":
-        output, response_type, source = handle_rag(query, chat_history)
-    elif intent == "conversation":
-        output, response_type, source = handle_conversation(query, chat_history)
-    else:
-        # Default to RAG for unknown intents
-        output, response_type, source = handle_rag(query, chat_history)
+    try:
+        with stage("handle"):
+            if followup:
+                output, response_type, source = handle_followup(intent, length, working_set)
+            elif intent == "greeting":
+                output, response_type, source = handle_conversation(query, chat_history, route="greeting")
+            elif intent == "summarize":
+                output, response_type, source = handle_summarize(query, length)
+            elif intent == "format_slack":
+                output, response_type, source = handle_format(query, "slack")
+            elif intent == "format_email":
+                output, response_type, source = handle_format(query, "email")
+            elif intent == "rag":
+                output, response_type, source = handle_rag(query, chat_history)
+            elif intent == "conversation":
+                output, response_type, source = handle_conversation(query, chat_history)
+            else:
+                # Default to RAG for unknown intents
+                output, response_type, source = handle_rag(query, chat_history)
+    finally:
+        _request_retrieval.reset(token)
+
+    # Follow-ups keep the chunks and sources they were built from; anything else replaces them
+    if working_set is not None:
+        working_set.answer = output
+        if not followup:
+            working_set.content = retrieval.get("content", "")
+            working_set.sources = source
 
     # Append source metadata if available
     if source:
         output += f"\n\n_Source: {source}_"
 
-    return {"output": output, "type": response_type}
+    return {"output": output, "type": response_type}, intent
 
 
 # --- Main function to run the agent ---
-def run_agent(query: str, chat_history: list = None):
+def run_agent(query: str, chat_history: list = None, profile: bool = None, session_id: str = None,
+              shards: list = None):
     """
     Main function to run the agent with a query and return the result.
+    Set profile=True (or RAG_PROFILE) to write a CPU/memory profile of this request.
+    Pass a stable session_id so follow-ups can reuse the previous answer.
+    Pass shards to restrict retrieval to some index shards.
     """
-    try:
-        result = process_query(query, chat_history)
-        return result
-    except Exception as e:
-        return {"output": f"An error occurred: {e}", "type": "error"}
+    query_hash = hashlib.sha256(query.encode()).hexdigest()[:12]
+    with profile_run("query", enabled=profile, query_hash=query_hash):
+        try:
+            result = process_query(query, chat_history, session_id, shards)
+            return result
+        except Exception as e:
+            return {"output": f"An error occurred: {e}", "type": "error"}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import random
+import numpy as np
+from src.ivfpq import IVFPQStore
+
+# Per-collection relevance threshold, computed from the index's own score distribution.
+# Short pseudo-queries are cut from sampled chunks. Their distance to their own chunk is
+# the "relevant" sample; their distance to random other chunks the "irrelevant" one.
+# The cut is the loosest distance that lets at most MAX_IRRELEVANT_PASS of unrelated
+# chunks through, but never so strict that the top decile of relevant samples fail.
+#
+# Both samples are biased: pseudo-queries are verbatim substrings and sit much closer to
+# their own chunk than real questions do, and "random other chunks" share the corpus'
+# topic (often a single paper), so the raw cut can land between "quote" and "same paper".
+# It is therefore clamped to [THRESHOLD_FLOOR, THRESHOLD_CEILING]: calibration can only
+# tighten the default RELEVANCE_THRESHOLD (1.2), and never by more than about 15%.
+CALIBRATION_FILE = "calibration.json"
+THRESHOLD_FLOOR = 1.0
+THRESHOLD_CEILING = 1.2
+MAX_IRRELEVANT_PASS = 0.01
+RELEVANT_PERCENTILE = 90
+SAMPLE_SIZE = 200
+NEGATIVES_PER_QUERY = 5
+PSEUDO_QUERY_WORDS = 12
+MIN_SAMPLES = 20
+
+
+def _sample_chunks(vector_db, sample_size: int, rng: random.Random) -> tuple:
+    """Return (texts, float32 vectors) for up to sample_size random chunks of the store."""
+    if isinstance(vector_db, IVFPQStore):
+        ids = rng.sample(range(vector_db.count()), min(sample_size, vector_db.count()))
+        texts = [doc.page_content for doc in vector_db.get_documents(ids)]
+        return texts, np.asarray(vector_db.index.vectors[ids], dtype=np.float32)
+    collection = vector_db._collection
+    all_ids = collection.get(include=[])["ids"]
+    ids = rng.sample(all_ids, min(sample_size, len(all_ids)))
+    data = collection.get(ids=ids, include=["documents", "embeddings"])
+    return data["documents"], np.asarray(data["embeddings"], dtype=np.float32)
+
+
+def calibrate_store(vector_db, embeddings, sample_size: int = SAMPLE_SIZE, seed: int = 0):
+    """Compute a relevance threshold for one store. Returns the calibration dict,
+    or None if the collection is too small to calibrate."""
+    rng = random.Random(seed)
+    texts, vectors = _sample_chunks(vector_db, sample_size, rng)
+
+    queries, targets = [], []
+    for i, text in enumerate(texts):
+        words = text.split()
+        if len(words) < PSEUDO_QUERY_WORDS // 2:
+            continue
+        start = rng.randrange(max(1, len(words) - PSEUDO_QUERY_WORDS))
+        queries.append(" ".join(words[start:start + PSEUDO_QUERY_WORDS]))
+        targets.append(i)
+    if len(queries) < MIN_SAMPLES or len(vectors) < 2:
+        return None
+
+    query_vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+    relevant = ((query_vectors - vectors[targets]) ** 2).sum(1)
+    irrelevant = []
+    for query_vector, target in zip(query_vectors, targets):
+        others = [j for j in rng.sample(range(len(vectors)), min(NEGATIVES_PER_QUERY + 1, len(vectors))) if j != target]
+        irrelevant.extend(((vectors[others[:NEGATIVES_PER_QUERY]] - query_vector) ** 2).sum(1))
+    irrelevant = np.asarray(irrelevant)
+
+    cut = max(
+        float(np.percentile(irrelevant, MAX_IRRELEVANT_PASS * 100)),
+        float(np.percentile(relevant, RELEVANT_PERCENTILE)),
+    )
+    threshold = min(max(cut, THRESHOLD_FLOOR), THRESHOLD_CEILING)
+    return {
+        "threshold": threshold,
+        "unclamped_threshold": round(cut, 4),
+        # Share of pseudo-queries that pass minus share of unrelated chunks that pass
+        "separation": round(float((relevant < threshold).mean() - (irrelevant < threshold).mean()), 4),
+        "irrelevant_pass_rate": round(float((irrelevant < threshold).mean()), 4),
+        "relevant_p50": round(float(np.percentile(relevant, 50)), 4),
+        "relevant_p90": round(float(np.percentile(relevant, 90)), 4),
+        "irrelevant_p10": round(float(np.percentile(irrelevant, 10)), 4),
+        "irrelevant_p50": round(float(np.percentile(irrelevant, 50)), 4),
+        "samples": len(queries),
+    }
+
+
+def save_calibration(directory: str, calibration: dict):
+    path = os.path.join(directory, CALIBRATION_FILE)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(calibration, f, indent=2)
+    os.replace(tmp_path, path)
+    print(f"Calibrated relevance threshold: {calibration['threshold']:.4f} "
+          f"(separation {calibration['separation']:.2f} over {calibration['samples']} samples)")
+
+
+def load_calibration(directory: str):
+    try:
+        with open(os.path.join(directory, CALIBRATION_FILE), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def calibrate_index(db_dir: str = "chroma_db", model_name: str = "all-MiniLM-L6-v2"):
+    """Recalibrate the published generation of every shard in place.
+    Running processes pick up the new thresholds on their next query."""
+    from langchain_chroma import Chroma
+    from src.embedding_server import load_embeddings
+    from src.generations import current_generation_dir, list_shards
+    from src.ivfpq import is_ivfpq_generation
+
+    if not os.path.isabs(db_dir):
+        db_dir = os.path.join(os.getcwd(), db_dir)
+    embeddings = load_embeddings(model_name)
+    for shard, root in list_shards(db_dir).items():
+        live_dir = current_generation_dir(root)
+        if is_ivfpq_generation(live_dir):
+            vector_db = IVFPQStore(persist_directory=live_dir, embedding_function=embeddings)
+        else:
+            vector_db = Chroma(persist_directory=live_dir, embedding_function=embeddings)
+        print(f"--- Shard: {shard} ---")
+        calibration = calibrate_store(vector_db, embeddings)
+        if calibration is None:
+            print("Too few chunks to calibrate; the default threshold stays in effect.")
+            continue
+        save_calibration(live_dir, calibration)
+
+
+if __name__ == "__main__":
+    calibrate_index()
@@ -0,0 +1,98 @@
+import os
+import hashlib
+import re
+import numpy as np
+
+# MinHash signatures over word shingles, bucketed with LSH banding so each chunk is
+# only compared against the few canonical chunks that share a band with it.
+NUM_PERM = 128
+# 32 bands x 4 rows puts the LSH midpoint at (1/32)^(1/4) ~ 0.42, well below DEDUP_THRESHOLD:
+# pairs at Jaccard 0.8 share a bucket with probability 1-(1-0.8^4)^32 > 0.9999, so
+# misses near the threshold come only from the signature estimate, not from banding.
+BANDS = 32
+SHINGLE_SIZE = 5
+DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.8"))  # estimated Jaccard similarity
+
+# Multiply-shift universal hashing (odd a, wrap-around uint64 arithmetic, keep the high 32 bits)
+_rng = np.random.default_rng(1)
+_A = (_rng.integers(0, 1 << 63, size=(NUM_PERM, 1), dtype=np.uint64) << np.uint64(1)) | np.uint64(1)
+_B = _rng.integers(0, 1 << 63, size=(NUM_PERM, 1), dtype=np.uint64)
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    tokens = _TOKEN_RE.findall(text.lower())
+    if len(tokens) < SHINGLE_SIZE:
+        shingles = {" ".join(tokens)}
+    else:
+        shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """Return the NUM_PERM-long MinHash signature of text's word shingles."""
+    hashes = _shingle_hashes(text)[np.newaxis, :]
+    with np.errstate(over="ignore"):
+        return ((_A * hashes + _B) >> np.uint64(32)).min(axis=1)
+
+
+def _estimated_jaccard(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    return np.count_nonzero(sig_a == sig_b) / NUM_PERM
+
+
+def deduplicate_chunks(splits: list, threshold: float = DEDUP_THRESHOLD) -> list:
+    """Keep one canonical chunk per near-duplicate cluster (first occurrence wins).
+    The canonical chunk's metadata records every source file of its cluster in
+    "sources" and the cluster size in "duplicate_count"."""
+    rows = NUM_PERM // BANDS
+    buckets = {}
+    canonical = []
+    signatures = []
+    cluster_sources = []
+    cluster_sizes = []
+
+    for doc in splits:
+        signature = minhash_signature(doc.page_content)
+        bands = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+        match = None
+        seen = set()
+        for key in bands:
+            for candidate in buckets.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if _estimated_jaccard(signature, signatures[candidate]) >= threshold:
+                    match = candidate
+                    break
+            if match is not None:
+                break
+
+        source = doc.metadata.get("source", "unknown")
+        if match is not None:
+            if source not in cluster_sources[match]:
+                cluster_sources[match].append(source)
+            cluster_sizes[match] += 1
+            continue
+
+        index = len(canonical)
+        canonical.append(doc)
+        signatures.append(signature)
+        cluster_sources.append([source])
+        cluster_sizes.append(1)
+        for key in bands:
+            buckets.setdefault(key, []).append(index)
+
+    # Chroma metadata values must be scalars, so sources are stored comma-joined
+    for doc, sources, size in zip(canonical, cluster_sources, cluster_sizes):
+        doc.metadata["sources"] = ", ".join(sources)
+        doc.metadata["duplicate_count"] = size
+
+    removed = len(splits) - len(canonical)
+    if splits:
+        print(f"Deduplicated chunks: {len(splits)} -> {len(canonical)} ({removed} near-duplicates removed, {removed / len(splits):.0%})")
+    return canonical
@@ -0,0 +1,232 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# One process owns the embedding model and serves every worker on the node over a
+# Unix socket, so N web workers share one copy of the model and one warm start.
+# Requests arriving within MAX_WAIT_MS of each other are embedded as one batch.
+#
+# Wire format (per request, on a persistent connection):
+#   request:  4-byte big-endian length + UTF-8 JSON {"model": ..., "texts": [...]}
+#   response: "!BII" header (status, n, dim); status 0 is followed by n*dim
+#             little-endian float32, otherwise by an n-byte UTF-8 error message.
+SOCKET_PATH = os.getenv("RAG_EMBEDDING_SOCKET", "")
+DEFAULT_SOCKET_PATH = "/tmp/rag-embeddings.sock"
+MAX_BATCH = int(os.getenv("RAG_EMBEDDING_MAX_BATCH", "64"))  # texts per forward pass
+MAX_WAIT_MS = float(os.getenv("RAG_EMBEDDING_MAX_WAIT_MS", "5"))  # how long to wait for more callers
+CLIENT_CHUNK = 256  # texts per request from a client
+CLIENT_TIMEOUT = float(os.getenv("RAG_EMBEDDING_TIMEOUT", "30"))  # seconds a client waits for a reply
+
+_HEADER = struct.Struct("!BII")
+_LENGTH = struct.Struct("!I")
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("Embedding server connection closed")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def load_embeddings(model_name: str):
+    """Return an embeddings object for model_name.
+    Uses the shared embedding server when RAG_EMBEDDING_SOCKET is set, otherwise loads
+    the model in-process. Both implement the LangChain Embeddings interface."""
+    if SOCKET_PATH:
+        return RemoteEmbeddings(model_name, SOCKET_PATH)
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embeddings client for the shared server; one persistent connection per thread."""
+
+    def __init__(self, model_name: str, socket_path: str = DEFAULT_SOCKET_PATH):
+        self.model_name = model_name
+        self.socket_path = socket_path
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(CLIENT_TIMEOUT)
+            try:
+                sock.connect(self.socket_path)
+            except OSError as e:
+                sock.close()
+                raise ConnectionError(
+                    f"Embedding server not reachable at {self.socket_path} ({e}). "
+                    "Start it with `python -m src.embedding_server` or unset RAG_EMBEDDING_SOCKET."
+                ) from e
+            self._local.sock = sock
+        return sock
+
+    def _request(self, texts: list) -> list:
+        payload = json.dumps({"model": self.model_name, "texts": texts}).encode()
+        for attempt in range(2):
+            sock = self._connection()
+            try:
+                sock.sendall(_LENGTH.pack(len(payload)) + payload)
+                status, n, dim = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+                body = _recv_exact(sock, n * dim * 4 if status == 0 else n)
+                break
+            except socket.timeout as e:
+                # The reply may still arrive later, so this connection can't be reused
+                sock.close()
+                self._local.sock = None
+                raise TimeoutError(
+                    f"Embedding server at {self.socket_path} did not reply within {CLIENT_TIMEOUT:g}s "
+                    "(RAG_EMBEDDING_TIMEOUT)."
+                ) from e
+            except (ConnectionError, OSError):
+                # Server restarted since this thread connected: reconnect once
+                sock.close()
+                self._local.sock = None
+                if attempt:
+                    raise
+        if status != 0:
+            raise RuntimeError(f"Embedding server error: {body.decode()}")
+        return np.frombuffer(body, dtype="<f4").reshape(n, dim).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        vectors = []
+        for start in range(0, len(texts), CLIENT_CHUNK):
+            vectors.extend(self._request(list(texts[start:start + CLIENT_CHUNK])))
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self._request([text])[0]
+
+
+class MicroBatcher:
+    """Collects concurrent embedding requests and runs them through the model together."""
+
+    def __init__(self, model, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.texts = 0
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def submit(self, texts: list) -> Future:
+        future = Future()
+        self._queue.put((texts, future))
+        return future
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            all_texts = [text for texts, _ in pending for text in texts]
+            try:
+                vectors = np.asarray(self.model.embed_documents(all_texts), dtype="<f4")
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(all_texts)
+            offset = 0
+            for texts, future in pending:
+                future.set_result(vectors[offset:offset + len(texts)])
+                offset += len(texts)
+
+
+def serve(socket_path: str = DEFAULT_SOCKET_PATH, model_name: str = "all-MiniLM-L6-v2"):
+    """Load the model once and serve embedding requests on socket_path until interrupted."""
+    if os.path.exists(socket_path):
+        # Only remove a stale socket; never take over one a running server is listening on
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+        else:
+            raise RuntimeError(f"An embedding server is already listening on {socket_path}")
+        finally:
+            probe.close()
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    model = HuggingFaceEmbeddings(model_name=model_name)
+    batcher = MicroBatcher(model)
+
+    class Handler(socketserver.BaseRequestHandler):
+        def send_error(self, message: str):
+            error = message.encode()
+            self.request.sendall(_HEADER.pack(1, len(error), 0) + error)
+
+        def handle(self):
+            while True:
+                try:
+                    (length,) = _LENGTH.unpack(_recv_exact(self.request, _LENGTH.size))
+                    payload = _recv_exact(self.request, length)
+                except ConnectionError:
+                    return
+                # A bad request gets an error frame; the connection stays usable
+                try:
+                    request = json.loads(payload)
+                    model, texts = request["model"], request["texts"]
+                    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                        raise ValueError("texts must be a list of strings")
+                except (ValueError, KeyError, TypeError) as e:
+                    self.send_error(f"malformed request: {e!r}")
+                    continue
+                if model != model_name:
+                    self.send_error(f"server has model {model_name}, not {model}")
+                    continue
+                try:
+                    vectors = batcher.submit(texts).result()
+                except Exception as e:
+                    self.send_error(str(e))
+                    continue
+                n, dim = vectors.shape if vectors.size else (0, 0)
+                self.request.sendall(_HEADER.pack(0, n, dim) + vectors.tobytes())
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    server.daemon_threads = True
+    print(f"Embedding server for {model_name} listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+        print(f"Served {batcher.texts} texts in {batcher.batches} batches")
+
+
+if __name__ == "__main__":
+    serve(SOCKET_PATH or DEFAULT_SOCKET_PATH)
@@ -0,0 +1,142 @@
+import os
+import hashlib
+import importlib.util
+import json
+import time
+from langchain_core.documents import Document
+
+# Extracted page text is cached per (file content hash, extractor) so re-chunking
+# or re-ingesting an unchanged file never re-parses it.
+EXTRACT_CACHE_DIR = os.path.join(os.getcwd(), ".extract_cache")
+
+
+def _extract_pymupdf(file_path: str) -> list:
+    import fitz  # PyMuPDF
+
+    with fitz.open(file_path) as pdf:
+        return [page.get_text() for page in pdf]
+
+
+def _extract_pypdfium2(file_path: str) -> list:
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        pages = []
+        for page in pdf:
+            text_page = page.get_textpage()
+            pages.append(text_page.get_text_range())
+            text_page.close()
+            page.close()
+        return pages
+    finally:
+        pdf.close()
+
+
+def _extract_pypdf(file_path: str) -> list:
+    from pypdf import PdfReader
+
+    return [page.extract_text() or "" for page in PdfReader(file_path).pages]
+
+
+# name -> (module that must be importable, function returning one string per page)
+EXTRACTORS = {
+    "pymupdf": ("fitz", _extract_pymupdf),
+    "pypdfium2": ("pypdfium2", _extract_pypdfium2),
+    "pypdf": ("pypdf", _extract_pypdf),
+}
+
+# Preference order per file extension; the first installed extractor wins.
+# RAG_PDF_EXTRACTOR=<name> forces a specific extractor for PDFs.
+FILE_TYPE_EXTRACTORS = {
+    ".pdf": ["pymupdf", "pypdfium2", "pypdf"],
+}
+
+
+def register_extractor(name: str, module: str, extract_fn, extensions: tuple = (".pdf",), prefer: bool = True):
+    """Register an extractor and add it to the preference list of the given extensions."""
+    EXTRACTORS[name] = (module, extract_fn)
+    for ext in extensions:
+        order = FILE_TYPE_EXTRACTORS.setdefault(ext, [])
+        if name in order:
+            order.remove(name)
+        if prefer:
+            order.insert(0, name)
+        else:
+            order.append(name)
+
+
+def is_supported(filename: str) -> bool:
+    return os.path.splitext(filename)[1].lower() in FILE_TYPE_EXTRACTORS
+
+
+def select_extractor(filename: str) -> str:
+    """Pick the extractor for a file based on its extension and what is installed."""
+    ext = os.path.splitext(filename)[1].lower()
+    forced = os.getenv(f"RAG_{ext.lstrip('.').upper()}_EXTRACTOR")
+    candidates = [forced] if forced else FILE_TYPE_EXTRACTORS.get(ext, [])
+    for name in candidates:
+        if name not in EXTRACTORS:
+            raise ValueError(f"Unknown extractor '{name}'. Available: {', '.join(EXTRACTORS)}")
+        if importlib.util.find_spec(EXTRACTORS[name][0]) is not None:
+            return name
+    raise RuntimeError(f"No installed extractor for '{ext}' files (tried: {', '.join(candidates)}).")
+
+
+def _file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pages(file_path: str, stats: dict = None) -> list:
+    """Return the text of each page of file_path, using the page cache when possible.
+    If `stats` is given, per-extractor page counts and timings are accumulated into it."""
+    name = select_extractor(file_path)
+    cache_file = os.path.join(EXTRACT_CACHE_DIR, f"{_file_hash(file_path)}-{name}.json")
+    entry = stats.setdefault(name, {"files": 0, "pages": 0, "seconds": 0.0, "cached_pages": 0}) if stats is not None else None
+
+    if os.path.exists(cache_file):
+        with open(cache_file, "r", encoding="utf-8") as f:
+            pages = json.load(f)["pages"]
+        if entry is not None:
+            entry["cached_pages"] += len(pages)
+        return pages
+
+    start = time.perf_counter()
+    pages = EXTRACTORS[name][1](file_path)
+    elapsed = time.perf_counter() - start
+    if entry is not None:
+        entry["files"] += 1
+        entry["pages"] += len(pages)
+        entry["seconds"] += elapsed
+
+    os.makedirs(EXTRACT_CACHE_DIR, exist_ok=True)
+    tmp_file = f"{cache_file}.tmp-{os.getpid()}"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump({"extractor": name, "pages": pages}, f)
+    os.replace(tmp_file, cache_file)
+    return pages
+
+
+def load_documents(documents_dir: str, stats: dict = None) -> list:
+    """Extract every supported file in documents_dir into one Document per page."""
+    documents = []
+    for filename in sorted(os.listdir(documents_dir)):
+        if not is_supported(filename):
+            continue
+        print(f"Processing: {filename}")
+        pages = extract_pages(os.path.join(documents_dir, filename), stats)
+        for page_number, text in enumerate(pages):
+            documents.append(Document(page_content=text, metadata={"source": filename, "page": page_number}))
+    return documents
+
+
+def report_extraction_stats(stats: dict):
+    """Print pages/s per extractor for the pages that were actually parsed."""
+    for name, entry in stats.items():
+        rate = entry["pages"] / entry["seconds"] if entry["seconds"] > 0 else 0.0
+        print(f"Extractor {name}: {entry['pages']} pages from {entry['files']} files "
+              f"in {entry['seconds']:.2f}s ({rate:.1f} pages/s), {entry['cached_pages']} pages from cache")
@@ -0,0 +1,154 @@
+import os
+import shutil
+import time
+
+# Each ingestion builds a fresh "generation" directory under <db_dir>/generations/.
+# The CURRENT pointer file names the generation that readers should open; it is
+# replaced atomically with os.replace so a reader never sees a half-written index.
+GENERATIONS_SUBDIR = "generations"
+POINTER_FILE = "CURRENT"
+KEEP_GENERATIONS = int(os.getenv("RAG_KEEP_GENERATIONS", "3"))
+
+# Shards: the default shard lives directly in db_dir (so single-shard layouts are
+# unchanged); named shards live in <db_dir>/shards/<name>/, each with its own
+# generations and CURRENT pointer.
+SHARDS_SUBDIR = "shards"
+DEFAULT_SHARD = "default"
+
+
+def shard_root(db_dir: str, shard: str = DEFAULT_SHARD) -> str:
+    """Directory holding the generations of one shard."""
+    if shard == DEFAULT_SHARD:
+        return db_dir
+    return os.path.join(db_dir, SHARDS_SUBDIR, shard)
+
+
+def list_shards(db_dir: str) -> dict:
+    """Map shard name -> shard root for every shard that has a published index."""
+    shards = {}
+    if current_generation_dir(db_dir) is not None:
+        shards[DEFAULT_SHARD] = db_dir
+    shards_dir = os.path.join(db_dir, SHARDS_SUBDIR)
+    if os.path.isdir(shards_dir):
+        for name in sorted(os.listdir(shards_dir)):
+            root = os.path.join(shards_dir, name)
+            if current_generation_dir(root) is not None:
+                shards[name] = root
+    return shards
+
+
+def _generations_root(db_dir: str) -> str:
+    return os.path.join(db_dir, GENERATIONS_SUBDIR)
+
+
+def list_generations(db_dir: str) -> list:
+    """Return generation names under db_dir, oldest first."""
+    root = _generations_root(db_dir)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+
+def current_generation(db_dir: str):
+    """Return the name of the published generation, or None if nothing is published."""
+    pointer = os.path.join(db_dir, POINTER_FILE)
+    try:
+        with open(pointer, "r") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if name and os.path.isdir(os.path.join(_generations_root(db_dir), name)):
+        return name
+    return None
+
+
+def current_generation_dir(db_dir: str):
+    """Return the path of the published generation.
+    Falls back to db_dir itself for indexes built before generations existed
+    (only while there is no CURRENT pointer, so an unpublished shard stays unpublished)."""
+    name = current_generation(db_dir)
+    if name is not None:
+        return os.path.join(_generations_root(db_dir), name)
+    if not os.path.exists(os.path.join(db_dir, POINTER_FILE)) and os.path.exists(os.path.join(db_dir, "chroma.sqlite3")):
+        return db_dir
+    return None
+
+
+def new_generation_dir(db_dir: str, fingerprint: str) -> str:
+    """Create and return an empty directory for the next generation.
+    Names start with a zero-padded sequence number so they sort in build order."""
+    existing = list_generations(db_dir)
+    sequence = int(existing[-1].split("-", 1)[0]) + 1 if existing else 1
+    while True:
+        name = f"{sequence:06d}-{time.strftime('%Y%m%d-%H%M%S')}-{fingerprint[:8]}"
+        path = os.path.join(_generations_root(db_dir), name)
+        try:
+            os.makedirs(path)
+            return path
+        except FileExistsError:
+            sequence += 1
+
+
+def _write_pointer(db_dir: str, name: str):
+    """Write CURRENT via a temp file + rename so readers see either the old or new name."""
+    pointer = os.path.join(db_dir, POINTER_FILE)
+    tmp_pointer = f"{pointer}.tmp-{os.getpid()}"
+    with open(tmp_pointer, "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_pointer, pointer)
+
+
+def publish_generation(db_dir: str, generation_dir: str):
+    """Atomically point CURRENT at generation_dir and prune old generations."""
+    _write_pointer(db_dir, os.path.basename(os.path.normpath(generation_dir)))
+    prune_generations(db_dir)
+
+
+def unpublish_generation(db_dir: str):
+    """Stop serving db_dir (a shard root) by emptying its CURRENT pointer; its generations
+    are kept until the next prune. Running processes drop the shard on their next query."""
+    _write_pointer(db_dir, "")
+
+
+def discard_generation(generation_dir: str):
+    """Remove a generation that failed to build or validate."""
+    shutil.rmtree(generation_dir, ignore_errors=True)
+
+
+def prune_generations(db_dir: str, keep: int = KEEP_GENERATIONS):
+    """Delete all but the newest `keep` generations. The published one is never deleted."""
+    current = current_generation(db_dir)
+    names = list_generations(db_dir)
+    for name in names[:-keep] if keep > 0 else names:
+        if name != current:
+            shutil.rmtree(os.path.join(_generations_root(db_dir), name), ignore_errors=True)
+
+
+def rollback_generation(db_dir: str = "chroma_db", steps: int = 1, shard: str = DEFAULT_SHARD) -> str:
+    """Re-publish the generation `steps` positions before the current one.
+    Running processes pick it up on their next query."""
+    if not os.path.isabs(db_dir):
+        db_dir = os.path.join(os.getcwd(), db_dir)
+    db_dir = shard_root(db_dir, shard)
+    names = list_generations(db_dir)
+    current = current_generation(db_dir)
+    if current not in names:
+        raise RuntimeError("No published generation to roll back from.")
+    index = names.index(current) - steps
+    if index < 0:
+        raise RuntimeError(f"Only {names.index(current)} older generation(s) kept; cannot roll back {steps}.")
+    target = names[index]
+    _write_pointer(db_dir, target)
+    print(f"Rolled back index from {current} to {target}")
+    return target
+
+
+if __name__ == "__main__":
+    import sys
+
+    rollback_generation(
+        steps=int(sys.argv[1]) if len(sys.argv) > 1 else 1,
+        shard=sys.argv[2] if len(sys.argv) > 2 else DEFAULT_SHARD,
+    )
@@ -0,0 +1,325 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+from langchain_core.documents import Document
+
+# Compressed retrieval backend: an inverted-file (IVF) coarse quantizer with
+# product-quantized (PQ) residual codes. Only the codes, ids and codebooks live in
+# RAM; full float32 vectors stay in a memory-mapped file and are read just for the
+# small candidate set that is re-scored exactly. Scores are exact squared L2, the
+# same metric Chroma reports, so RELEVANCE_THRESHOLD keeps its meaning.
+IVFPQ_FILE = "index.ivfpq.npz"
+VECTORS_FILE = "vectors.f32"
+DOCS_FILE = "docs.sqlite3"
+NPROBE = int(os.getenv("RAG_IVFPQ_NPROBE", "8"))  # inverted lists scanned per query
+RERANK = int(os.getenv("RAG_IVFPQ_RERANK", "64"))  # PQ candidates re-scored exactly
+PQ_BITS = 8  # one uint8 code per sub-vector
+MAX_TRAIN_POINTS = 100_000  # coarse quantizer training sample
+PQ_TRAIN_POINTS_PER_CODE = 64  # PQ codebooks need far fewer points than the coarse quantizer
+ENCODE_BATCH = 65536  # vectors assigned and PQ-encoded per step of the build
+
+
+def _sq_distances(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Squared L2 distances between every row of x and every centroid."""
+    dist = (x * x).sum(1)[:, None] - 2 * x @ centroids.T + (centroids * centroids).sum(1)[None, :]
+    return np.maximum(dist, 0)
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, batch: int = 8192) -> np.ndarray:
+    """Index of the nearest centroid for each row of x, computed in batches to bound memory."""
+    return np.concatenate([
+        _sq_distances(x[start:start + batch], centroids).argmin(1)
+        for start in range(0, len(x), batch)
+    ]) if len(x) else np.zeros(0, dtype=np.int64)
+
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means; empty clusters are re-seeded from random points."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(x, centroids)
+        counts = np.bincount(assign, minlength=k)
+        nonempty = np.flatnonzero(counts)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        centroids[nonempty] = np.add.reduceat(x[order], starts, axis=0) / counts[nonempty, None]
+        empty = counts == 0
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def _default_subquantizers(dim: int) -> int:
+    """Largest divisor of dim giving sub-vectors of at least 8 dims (48 for MiniLM's 384)."""
+    for m in range(max(dim // 8, 1), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+class IVFPQIndex:
+    """Inverted lists of PQ-encoded residuals with exact re-scoring from disk."""
+
+    def __init__(self, coarse, codebooks, list_offsets, ids, codes, vectors):
+        self.coarse = coarse  # (nlist, dim)
+        self.codebooks = codebooks  # (m, ksub, dsub)
+        self.list_offsets = list_offsets  # (nlist + 1,) start of each list in ids/codes
+        self.ids = ids  # (n,) row in `vectors`, grouped by list
+        self.codes = codes  # (n, m) uint8, same order as ids
+        self.vectors = vectors  # (n, dim) float32 memmap
+
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    def memory_bytes(self) -> int:
+        """Bytes held in RAM (the memory-mapped full vectors are not counted)."""
+        return sum(a.nbytes for a in (self.coarse, self.codebooks, self.list_offsets, self.ids, self.codes))
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, directory: str, nlist: int = None, m: int = None, seed: int = 0):
+        """Train the coarse quantizer and PQ codebooks on vectors, encode them and save to directory.
+        If vectors is already a memmap of directory's vectors file (as from_documents writes it),
+        it is used in place; vectors are encoded ENCODE_BATCH rows at a time."""
+        os.makedirs(directory, exist_ok=True)
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        in_place = (
+            isinstance(vectors, np.memmap) and os.path.exists(vectors_path)
+            and os.path.samefile(vectors.filename, vectors_path)
+        )
+        if not in_place:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            vectors.tofile(vectors_path)
+        n, dim = vectors.shape
+        nlist = nlist or int(np.clip(4 * np.sqrt(n), 1, n))
+        m = m or _default_subquantizers(dim)
+        dsub = dim // m
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(vectors[np.sort(rng.choice(n, min(n, MAX_TRAIN_POINTS), replace=False))], dtype=np.float32)
+
+        coarse = _kmeans(sample, nlist, seed=seed)
+        sample_residuals = sample - coarse[_assign(sample, coarse)]
+
+        ksub = min(1 << PQ_BITS, len(sample))
+        # The sample is in row (ingest) order, so draw the PQ subset randomly rather than truncating
+        pq_train = min(len(sample_residuals), ksub * PQ_TRAIN_POINTS_PER_CODE)
+        sample_residuals = sample_residuals[rng.choice(len(sample_residuals), pq_train, replace=False)]
+        codebooks = np.stack([
+            _kmeans(np.ascontiguousarray(sample_residuals[:, j * dsub:(j + 1) * dsub]), ksub, seed=seed + j)
+            for j in range(m)
+        ])
+
+        # Encode in batches so only one batch of residuals is ever materialized
+        assign = np.empty(n, dtype=np.int64)
+        codes = np.empty((n, m), dtype=np.uint8)
+        for start in range(0, n, ENCODE_BATCH):
+            batch = np.asarray(vectors[start:start + ENCODE_BATCH], dtype=np.float32)
+            batch_assign = _assign(batch, coarse)
+            residuals = batch - coarse[batch_assign]
+            assign[start:start + len(batch)] = batch_assign
+            codes[start:start + len(batch)] = np.stack([
+                _assign(np.ascontiguousarray(residuals[:, j * dsub:(j + 1) * dsub]), codebooks[j])
+                for j in range(m)
+            ], axis=1)
+
+        order = np.argsort(assign, kind="stable")
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=len(coarse))))).astype(np.int64)
+        ids = order.astype(np.int32 if n < 2 ** 31 else np.int64)
+
+        np.savez(
+            os.path.join(directory, IVFPQ_FILE),
+            coarse=coarse, codebooks=codebooks, list_offsets=list_offsets, ids=ids, codes=codes[order],
+        )
+        return cls.load(directory)
+
+    @classmethod
+    def load(cls, directory: str):
+        data = np.load(os.path.join(directory, IVFPQ_FILE))
+        dim = data["coarse"].shape[1]
+        vectors = np.memmap(os.path.join(directory, VECTORS_FILE), dtype=np.float32, mode="r").reshape(-1, dim)
+        return cls(data["coarse"], data["codebooks"], data["list_offsets"], data["ids"], data["codes"], vectors)
+
+    def search(self, queries: np.ndarray, k: int, nprobe: int = NPROBE, rerank: int = RERANK) -> list:
+        """Return (ids, squared L2 distances) for each query, nearest first."""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.coarse.shape[1])
+        m, ksub, dsub = self.codebooks.shape
+        nprobe = min(nprobe, len(self.coarse))
+        probes = np.argsort(_sq_distances(queries, self.coarse), axis=1)[:, :nprobe]
+        subspaces = np.arange(m)
+        results = []
+
+        for query, lists in zip(queries, probes):
+            candidate_ids, approx = [], []
+            for li in lists:
+                start, end = self.list_offsets[li], self.list_offsets[li + 1]
+                if start == end:
+                    continue
+                # Asymmetric distance: query residual vs. every codeword, then table lookups
+                residual = (query - self.coarse[li]).reshape(m, 1, dsub)
+                table = ((self.codebooks - residual) ** 2).sum(-1)  # (m, ksub)
+                approx.append(table[subspaces, self.codes[start:end]].sum(1))
+                candidate_ids.append(self.ids[start:end])
+
+            if not candidate_ids:
+                results.append((np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)))
+                continue
+            candidate_ids = np.concatenate(candidate_ids)
+            approx = np.concatenate(approx)
+            if len(approx) > rerank:
+                keep = np.argpartition(approx, rerank)[:rerank]
+                candidate_ids = candidate_ids[keep]
+
+            # Exact re-scoring of the shortlist against the full vectors on disk
+            candidate_ids = np.sort(candidate_ids)
+            exact = ((self.vectors[candidate_ids] - query) ** 2).sum(1)
+            top = np.argsort(exact)[:k]
+            results.append((candidate_ids[top], exact[top]))
+        return results
+
+
+class IVFPQStore:
+    """Vector store over an IVFPQIndex exposing the subset of the Chroma API we use."""
+
+    def __init__(self, persist_directory: str, embedding_function):
+        self.index = IVFPQIndex.load(persist_directory)
+        self._embedding = embedding_function
+        self._docs = sqlite3.connect(os.path.join(persist_directory, DOCS_FILE), check_same_thread=False)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_documents(cls, documents: list, embedding, persist_directory: str, batch_size: int = 256):
+        """Embed documents a batch at a time straight into the memory-mapped vectors file,
+        so the corpus' embeddings are never all held in RAM."""
+        if not documents:
+            raise ValueError("Cannot build an IVF-PQ index from an empty document list")
+        os.makedirs(persist_directory, exist_ok=True)
+        vectors = None
+        for start in range(0, len(documents), batch_size):
+            batch = documents[start:start + batch_size]
+            embedded = np.asarray(embedding.embed_documents([doc.page_content for doc in batch]), dtype=np.float32)
+            if vectors is None:
+                vectors = np.memmap(
+                    os.path.join(persist_directory, VECTORS_FILE), dtype=np.float32, mode="w+",
+                    shape=(len(documents), embedded.shape[1]),
+                )
+            vectors[start:start + len(batch)] = embedded
+        vectors.flush()
+        IVFPQIndex.build(vectors, persist_directory)
+        del vectors
+
+        with sqlite3.connect(os.path.join(persist_directory, DOCS_FILE)) as conn:
+            conn.execute("CREATE TABLE docs (id INTEGER PRIMARY KEY, content TEXT, metadata TEXT)")
+            conn.executemany(
+                "INSERT INTO docs VALUES (?, ?, ?)",
+                ((i, doc.page_content, json.dumps(doc.metadata)) for i, doc in enumerate(documents)),
+            )
+        return cls(persist_directory, embedding)
+
+    def count(self) -> int:
+        return self.index.size
+
+    def close(self):
+        with self._lock:
+            self._docs.close()
+
+    def get_documents(self, ids) -> list:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return []
+        with self._lock:
+            rows = self._docs.execute(
+                f"SELECT id, content, metadata FROM docs WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+        by_id = {row[0]: Document(page_content=row[1], metadata=json.loads(row[2])) for row in rows}
+        return [by_id[i] for i in ids]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list:
+        return self.similarity_search_by_vectors_with_score([self._embedding.embed_query(query)], k)[0]
+
+    def similarity_search_by_vectors_with_score(self, vectors: list, k: int = 4) -> list:
+        """Search several query vectors at once; one (Document, score) list per vector."""
+        results = self.index.search(np.asarray(vectors, dtype=np.float32), k)
+        docs = iter(self.get_documents(np.concatenate([ids for ids, _ in results])))
+        return [[(next(docs), float(d)) for d in distances] for _, distances in results]
+
+    def search_ids_by_vectors(self, vectors: list, k: int = 4) -> list:
+        """Like similarity_search_by_vectors_with_score but returns (id, score) pairs
+        without loading documents, so callers can drop out-of-range hits first."""
+        results = self.index.search(np.asarray(vectors, dtype=np.float32), k)
+        return [[(int(i), float(d)) for i, d in zip(ids, distances)] for ids, distances in results]
+
+    def similarity_search(self, query: str, k: int = 4) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+
+def is_ivfpq_generation(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, IVFPQ_FILE))
+
+
+def benchmark_against_chroma(db_dir: str = "chroma_db", k: int = 5, num_queries: int = 200, noise: float = 0.05):
+    """Compare an IVF-PQ index built from the published Chroma generation against Chroma itself.
+    Queries are stored chunk vectors with Gaussian noise; ground truth is exact brute force."""
+    import tempfile
+    from langchain_chroma import Chroma
+    from src.generations import current_generation_dir
+
+    if not os.path.isabs(db_dir):
+        db_dir = os.path.join(os.getcwd(), db_dir)
+    live_dir = current_generation_dir(db_dir)
+    if live_dir is None or is_ivfpq_generation(live_dir):
+        raise RuntimeError("Benchmark needs a published Chroma generation; run ingestion with the default backend first.")
+
+    collection = Chroma(persist_directory=live_dir)._collection
+    data = collection.get(include=["embeddings"])
+    row_of = {doc_id: row for row, doc_id in enumerate(data["ids"])}
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    n = len(vectors)
+
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(n, min(num_queries, n), replace=False)]
+    queries = queries + rng.normal(0, noise, queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    exact = [set(np.argsort(row)[:k]) for row in _sq_distances(queries, vectors)]
+
+    def recall(found: list) -> float:
+        return float(np.mean([len(set(f) & truth) / len(truth) for f, truth in zip(found, exact)]))
+
+    start = time.perf_counter()
+    chroma_found = [
+        [row_of[doc_id] for doc_id in collection.query(query_embeddings=[q.tolist()], n_results=k, include=[])["ids"][0]]
+        for q in queries
+    ]
+    chroma_latency = (time.perf_counter() - start) / len(queries)
+    chroma_bytes = sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(live_dir) if root != live_dir
+        for f in files
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = IVFPQIndex.build(vectors, tmp)
+        start = time.perf_counter()
+        ivfpq_found = [ids for ids, _ in (index.search(q, k)[0] for q in queries)]
+        ivfpq_latency = (time.perf_counter() - start) / len(queries)
+        ivfpq_bytes = index.memory_bytes()
+        del index
+
+    print(f"{n} chunks, {vectors.shape[1]} dims, {len(queries)} queries, k={k}")
+    print(f"{'backend':<10}{'bytes/chunk':>14}{'recall@' + str(k):>12}{'latency (ms)':>15}")
+    print(f"{'chroma':<10}{chroma_bytes / n:>14.1f}{recall(chroma_found):>12.3f}{chroma_latency * 1000:>15.2f}")
+    print(f"{'ivfpq':<10}{ivfpq_bytes / n:>14.1f}{recall(ivfpq_found):>12.3f}{ivfpq_latency * 1000:>15.2f}")
+    print("(chroma bytes are its HNSW segment files; ivfpq bytes are RAM-resident codes, ids and codebooks)")
+
+
+if __name__ == "__main__":
+    benchmark_against_chroma()
@@ -0,0 +1,326 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Load generator for the agent. Replays a recorded query log (JSONL) or a synthetic
+# intent mix against run_agent in-process or against the HTTP API, either closed-loop
+# (fixed concurrency) or open-loop (Poisson arrivals at a fixed rate), sweeping the
+# load level to find where throughput stops scaling. By default every LLM call goes to
+# a local fake with a lognormal latency, so runs measure our pipeline, not the provider.
+
+SYNTHETIC_QUERIES = {
+    "greeting": ["hi", "thanks!", "hello there", "hey, how are you doing today?"],
+    "rag": [
+        "What is the main contribution of the paper?",
+        "Which modalities are fused for facial expression recognition?",
+        "What datasets were used in the experiments?",
+        "Explain the temporal model used in the paper.",
+        "What accuracy does the proposed method reach?",
+    ],
+    "summarize": ["Summarize the documents.", "Give me a detailed summary of the paper.", "What are the key points?"],
+    "format_slack": ["Format the key findings as a Slack message.", "Write a Slack update about the results."],
+    "format_email": ["Draft an email to leadership about the paper's findings.", "Format the conclusions as an executive email."],
+    "conversation": ["What can you help me with?", "Explain XAI in simple terms."],
+}
+DEFAULT_MIX = {"greeting": 0.1, "rag": 0.5, "summarize": 0.15, "format_slack": 0.1, "format_email": 0.1, "conversation": 0.05}
+SATURATION_GAIN = 0.05  # next load level must add >5% throughput to count as still scaling
+
+
+class FakeLLM:
+    """Stands in for ChatGoogleGenerativeAI: sleeps for a lognormal latency and returns canned text.
+    Classification prompts get a keyword-based intent so every handler path is exercised."""
+
+    median_seconds = 0.8
+    sigma = 0.5
+
+    def __init__(self, model: str = "fake", temperature: float = 0, **kwargs):
+        self.model = model
+
+    @staticmethod
+    def _classify(query: str) -> str:
+        q = query.lower()
+        if "slack" in q:
+            return "format_slack"
+        if "email" in q:
+            return "format_email"
+        if re.search(r"summar|key points|overview", q):
+            return "summarize"
+        if re.match(r"(hi|hello|hey|thanks)\b", q):
+            return "greeting"
+        if re.search(r"\b(what|which|explain|how|tell)\b", q):
+            return "rag"
+        return "conversation"
+
+    def invoke(self, prompt):
+        from langchain_core.messages import AIMessage
+
+        text = prompt if isinstance(prompt, str) else prompt[-1]["content"]
+        time.sleep(random.lognormvariate(math.log(self.median_seconds), self.sigma))
+        match = re.search(r'User query: "(.*)"', text)
+        if "Classify the user's intent" in text and match:
+            content = json.dumps({"intent": self._classify(match.group(1)), "length": "default", "followup": False})
+        else:
+            content = "This is a synthetic answer from the load-test LLM. " * 8
+        input_tokens, output_tokens = len(text) // 4, len(content) // 4
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+        })
+
+
+def load_workload(log_path: str = None, mix: dict = None, seed: int = 0) -> list:
+    """Return (intent label or None, query) pairs from a JSONL log, or a shuffled synthetic mix.
+    Log records carry "query" and an optional "intent"."""
+    if log_path:
+        workload = []
+        with open(log_path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                query = record.get("query")
+                if query:
+                    workload.append((record.get("intent"), query))
+        if not workload:
+            raise ValueError(f"No queries found in {log_path}")
+        return workload
+
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    intents = list(mix)
+    weights = [mix[intent] for intent in intents]
+    workload = []
+    for intent in rng.choices(intents, weights=weights, k=1000):
+        workload.append((intent, rng.choice(SYNTHETIC_QUERIES[intent])))
+    return workload
+
+
+def install_fake_llm(median_seconds: float = FakeLLM.median_seconds, sigma: float = FakeLLM.sigma):
+    """Route every LLM call of the agent in this process to FakeLLM."""
+    os.environ.setdefault("GOOGLE_API_KEY", "load-test")
+    FakeLLM.median_seconds, FakeLLM.sigma = median_seconds, sigma
+    from src import agentic_rag_assistant as rag
+
+    rag.ChatGoogleGenerativeAI = FakeLLM
+    rag._llms.clear()
+
+
+def _in_process_caller():
+    from src.agentic_rag_assistant import run_agent
+
+    def call(query: str) -> tuple:
+        result = run_agent(query)
+        return result.get("type"), result.get("type") != "error"
+    return call
+
+
+def _http_caller(url: str, timeout: float = 120):
+    endpoint = url.rstrip("/") + "/query"
+
+    def call(query: str) -> tuple:
+        request = urllib.request.Request(
+            endpoint, data=json.dumps({"query": query}).encode(), headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read()).get("type"), True
+        except urllib.error.HTTPError as e:
+            return f"http_{e.code}", False
+        except (urllib.error.URLError, TimeoutError):
+            return "unreachable", False
+    return call
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _label(intent: str, response_type: str) -> str:
+    """Report label for a sample. Unlabeled log queries are grouped by response type, which is
+    not their intent (a RAG fallback and a greeting are both "conversational"), so say so."""
+    return intent or f"type:{response_type}"
+
+
+def _summarize(samples: list, elapsed: float) -> dict:
+    """samples: (label, latency seconds, ok) triples."""
+    by_intent = {}
+    for label, latency, ok in samples:
+        by_intent.setdefault(label, []).append(latency)
+    errors = sum(1 for _, _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / elapsed, 3) if elapsed > 0 else 0.0,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "intents": {
+            label: {
+                "count": len(latencies),
+                "p50": round(_percentile(sorted(latencies), 50), 4),
+                "p90": round(_percentile(sorted(latencies), 90), 4),
+                "p99": round(_percentile(sorted(latencies), 99), 4),
+            }
+            for label, latencies in sorted(by_intent.items(), key=lambda item: str(item[0]))
+        },
+    }
+
+
+def run_closed_loop(call, workload: list, concurrency: int, duration: float) -> dict:
+    """`concurrency` clients each send their next request as soon as the previous one returns."""
+    items = itertools.cycle(workload)
+    items_lock = threading.Lock()
+    samples = []
+    samples_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            with items_lock:
+                intent, query = next(items)
+            start = time.perf_counter()
+            response_type, ok = call(query)
+            latency = time.perf_counter() - start
+            with samples_lock:
+                samples.append((_label(intent, response_type), latency, ok))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return _summarize(samples, time.perf_counter() - start)
+
+
+def run_open_loop(call, workload: list, rate: float, duration: float, max_in_flight: int = 256, seed: int = 0) -> dict:
+    """Poisson arrivals at `rate` req/s. Latency counts from the scheduled arrival time,
+    so queueing delay under overload is not hidden (no coordinated omission)."""
+    rng = random.Random(seed)
+    items = itertools.cycle(workload)
+    samples = []
+    samples_lock = threading.Lock()
+
+    def send(intent, query, scheduled):
+        response_type, ok = call(query)
+        with samples_lock:
+            samples.append((_label(intent, response_type), time.perf_counter() - scheduled, ok))
+
+    start = time.perf_counter()
+    next_arrival = start
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        while next_arrival < start + duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            intent, query = next(items)
+            pool.submit(send, intent, query, next_arrival)
+            next_arrival += rng.expovariate(rate)
+    return _summarize(samples, time.perf_counter() - start)
+
+
+def find_saturation(levels: list) -> dict:
+    """The last load level before throughput stops growing by more than SATURATION_GAIN."""
+    for current, following in zip(levels, levels[1:]):
+        if following["throughput_rps"] < current["throughput_rps"] * (1 + SATURATION_GAIN):
+            return current
+    return None
+
+
+def _print_level(level: dict):
+    print(f"\n{level['mode']}={level['load']}: {level['requests']} requests, "
+          f"{level['throughput_rps']} req/s, error rate {level['error_rate']:.2%}")
+    print(f"  {'intent':<22}{'count':>7}{'p50 (s)':>10}{'p90 (s)':>10}{'p99 (s)':>10}")
+    for label, stats in level["intents"].items():
+        print(f"  {str(label):<22}{stats['count']:>7}{stats['p50']:>10.3f}{stats['p90']:>10.3f}{stats['p99']:>10.3f}")
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Replay recorded or synthetic traffic against the RAG agent.")
+    parser.add_argument("--target", default="inprocess", help="'inprocess' (run_agent) or the base URL of the HTTP API")
+    parser.add_argument("--log", help="JSONL query log to replay (fields: query, optional intent)")
+    parser.add_argument("--mix", help="synthetic intent mix, e.g. rag=0.6,summarize=0.2,greeting=0.2")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="closed-loop sweep of concurrent clients")
+    parser.add_argument("--rate", help="open-loop sweep of arrival rates in req/s (overrides --concurrency)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per load level")
+    parser.add_argument("--real-llm", action="store_true", help="call the configured LLMs instead of the fake")
+    parser.add_argument("--fake-llm-median", type=float, default=FakeLLM.median_seconds, help="fake LLM median latency (s)")
+    parser.add_argument("--fake-llm-sigma", type=float, default=FakeLLM.sigma, help="fake LLM lognormal sigma")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write results as JSON for run-to-run comparison")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="instead of generating load, run the HTTP API on PORT with the fake LLM installed")
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        import uvicorn
+
+        install_fake_llm(args.fake_llm_median, args.fake_llm_sigma)
+        from src.server import app
+
+        uvicorn.run(app, host="127.0.0.1", port=args.serve)
+        return
+
+    mix = None
+    if args.mix:
+        mix = {name: float(weight) for name, weight in (part.split("=") for part in args.mix.split(","))}
+        unknown = set(mix) - set(SYNTHETIC_QUERIES)
+        if unknown:
+            parser.error(f"unknown intents in --mix: {', '.join(sorted(unknown))}")
+    workload = load_workload(args.log, mix, args.seed)
+
+    if args.target == "inprocess":
+        if not args.real_llm:
+            install_fake_llm(args.fake_llm_median, args.fake_llm_sigma)
+        call = _in_process_caller()
+    else:
+        # The server decides which LLM it calls; start it with --serve PORT for the fake one
+        call = _http_caller(args.target)
+
+    random.seed(args.seed)
+    mode = "rate" if args.rate else "concurrency"
+    loads = [float(x) for x in args.rate.split(",")] if args.rate else [int(x) for x in args.concurrency.split(",")]
+    levels = []
+    for load in loads:
+        if mode == "rate":
+            level = run_open_loop(call, workload, load, args.duration, seed=args.seed)
+        else:
+            level = run_closed_loop(call, workload, load, args.duration)
+        level.update(mode=mode, load=load)
+        levels.append(level)
+        _print_level(level)
+
+    saturation = find_saturation(levels)
+    if saturation is not None:
+        print(f"\nSaturation point: {mode}={saturation['load']} ({saturation['throughput_rps']} req/s)")
+    else:
+        print("\nNo saturation within the tested load levels.")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "target": args.target,
+                "log": args.log,
+                "fake_llm": None if args.real_llm else {"median_seconds": args.fake_llm_median, "sigma": args.fake_llm_sigma},
+                "duration": args.duration,
+                "levels": levels,
+                "saturation": saturation and {"mode": mode, "load": saturation["load"], "throughput_rps": saturation["throughput_rps"]},
+            }, f, indent=2)
+        print(f"Results written to: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
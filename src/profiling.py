@@ -0,0 +1,199 @@
+import os
+import contextvars
+import cProfile
+import json
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# Opt-in profiling for queries and ingestion runs.
+# RAG_PROFILE=cprofile (or 1) writes a cProfile .prof file; RAG_PROFILE=sample runs a
+# statistical sampler and writes flamegraph-ready collapsed stacks. Either mode also
+# records tracemalloc peak memory and top allocation sites. When profiling is off the
+# only cost is a context variable lookup per stage.
+PROFILE_MODE = os.getenv("RAG_PROFILE", "").lower()
+PROFILE_DIR = os.getenv("RAG_PROFILE_DIR", os.path.join(os.getcwd(), "profiles"))
+KEEP_PROFILES = int(os.getenv("RAG_PROFILE_KEEP", "50"))
+SAMPLE_INTERVAL = float(os.getenv("RAG_PROFILE_INTERVAL", "0.005"))  # seconds between samples
+TOP_ALLOCATIONS = 25
+
+_current_run = contextvars.ContextVar("rag_profile_run", default=None)
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _resolve_mode(enabled) -> str:
+    """Per-call flag wins over the environment: True/False, or an explicit mode string."""
+    if enabled is None:
+        mode = PROFILE_MODE
+    elif enabled is True:
+        mode = PROFILE_MODE if PROFILE_MODE not in ("", "0", "false") else "cprofile"
+    elif enabled is False:
+        mode = ""
+    else:
+        mode = str(enabled).lower()
+    if mode in ("", "0", "false", "off"):
+        return ""
+    return "sample" if mode == "sample" else "cprofile"
+
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, target_thread_id: int, interval: float):
+        super().__init__(name="rag-profile-sampler", daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class ProfileRun:
+    """Collects stage timings and tags for one profiled run."""
+
+    def __init__(self, kind: str, mode: str, tags: dict):
+        self.kind = kind
+        self.mode = mode
+        self.tags = dict(tags)
+        self.stages = {}
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    """Returns (peak bytes, snapshot). Peak is process-wide, so it includes concurrent runs."""
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+    return peak, snapshot
+
+
+def _rotate_profiles(keep: int = KEEP_PROFILES):
+    runs = sorted(os.listdir(PROFILE_DIR))
+    for name in runs[:-keep] if keep > 0 else runs:
+        shutil.rmtree(os.path.join(PROFILE_DIR, name), ignore_errors=True)
+
+
+def _write_run(run: ProfileRun, wall_seconds: float, profiler, sampler, peak: int, snapshot):
+    label = "-".join(str(run.tags[key]) for key in ("intent", "query_hash") if run.tags.get(key))
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{os.getpid()}-{run.kind}"
+    run_dir = os.path.join(PROFILE_DIR, f"{name}-{label}" if label else name)
+    os.makedirs(run_dir, exist_ok=True)
+
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(run_dir, "cpu.prof"))
+    if sampler is not None:
+        with open(os.path.join(run_dir, "stacks.collapsed"), "w") as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    with open(os.path.join(run_dir, "memory.txt"), "w") as f:
+        f.write(f"Peak traced memory: {peak / 1024 / 1024:.2f} MiB\n\nTop allocation sites:\n")
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+            f.write(f"{stat}\n")
+
+    with open(os.path.join(run_dir, "meta.json"), "w") as f:
+        json.dump({
+            "kind": run.kind,
+            "mode": run.mode,
+            "tags": run.tags,
+            "wall_seconds": round(wall_seconds, 4),
+            "stage_seconds": {stage: round(seconds, 4) for stage, seconds in run.stages.items()},
+            "peak_traced_bytes": peak,
+        }, f, indent=2)
+
+    _rotate_profiles()
+    print(f"Profile written to: {run_dir}")
+
+
+@contextmanager
+def profile_run(kind: str, enabled=None, **tags):
+    """Profile the enclosed block if enabled (per-call flag, else RAG_PROFILE).
+    Yields the ProfileRun, or None when profiling is off."""
+    mode = _resolve_mode(enabled)
+    if not mode or _current_run.get() is not None:
+        yield None
+        return
+
+    run = ProfileRun(kind, mode, tags)
+    token = _current_run.set(run)
+    profiler = sampler = None
+    _start_tracemalloc()
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active on this interpreter (e.g. a concurrent request)
+            profiler = None
+            run.mode = "sample"
+    if profiler is None:
+        sampler = _StackSampler(threading.get_ident(), SAMPLE_INTERVAL)
+        sampler.start()
+
+    start = time.perf_counter()
+    try:
+        yield run
+    finally:
+        wall_seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+        if sampler is not None:
+            sampler.stop()
+        peak, snapshot = _stop_tracemalloc()
+        _current_run.reset(token)
+        try:
+            _write_run(run, wall_seconds, profiler, sampler, peak, snapshot)
+        except OSError as e:
+            print(f"Could not write profile: {e}")
+
+
+@contextmanager
+def stage(name: str):
+    """Time a named stage of the current profiled run (no-op when not profiling)."""
+    run = _current_run.get()
+    if run is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.stages[name] = run.stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def annotate(**tags):
+    """Attach tags (e.g. intent) to the current profiled run, if any."""
+    run = _current_run.get()
+    if run is not None:
+        run.tags.update(tags)
@@ -0,0 +1,157 @@
+import os
+import sys
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from src import agentic_rag_assistant as rag
+from src.generations import current_generation, list_shards
+
+# Threads that run the (blocking) agent pipeline in each server process
+WORKERS = int(os.getenv("RAG_SERVER_WORKERS", "8"))
+# Pipelines allowed to wait for a free worker before new ones are shed with 503
+MAX_QUEUE = int(os.getenv("RAG_MAX_QUEUE", "32"))
+# Seconds a client waits for its answer before getting a 504
+REQUEST_TIMEOUT = float(os.getenv("RAG_REQUEST_TIMEOUT", "60"))
+
+
+class SingleFlight:
+    """Coalesces identical in-flight calls so a burst of the same key runs once.
+    All callers await the leader's task; a caller timing out does not cancel it."""
+
+    def __init__(self):
+        self._inflight = {}
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def get(self, key: str):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        return task
+
+    def start(self, key: str, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+
+class QueryRequest(BaseModel):
+    query: str
+    chat_history: Optional[list] = None
+    profile: bool = False  # write a CPU/memory profile for this request
+    session_id: Optional[str] = None  # lets follow-ups reuse this session's previous answer
+    shards: Optional[list] = None  # restrict retrieval to these index shards
+
+
+class QueryResponse(BaseModel):
+    output: str
+    type: str
+
+
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="rag-worker")
+flights = SingleFlight()
+warm = {"embeddings": False, "vector_db": False}
+
+
+def _warm_up():
+    """Load the vector store and run one embedding so the first request isn't a cold start."""
+    rag.embeddings.embed_query("warm up")
+    warm["embeddings"] = True
+    rag._get_shard_dbs()
+    warm["vector_db"] = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(executor, _warm_up)
+    except Exception as e:
+        # Serve anyway; /health reports what is still cold
+        print(f"Warm-up failed: {e}")
+    yield
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="RAG Agent Assistant API", lifespan=lifespan)
+
+
+def _request_key(request: QueryRequest) -> str:
+    payload = json.dumps(
+        [request.query.strip(), request.chat_history or [], request.profile, request.session_id, request.shards],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@app.post("/query", response_model=QueryResponse)
+async def query(request: QueryRequest):
+    key = _request_key(request)
+    task = flights.get(key)
+    if task is None:
+        # Only distinct pipelines count against capacity; coalesced callers are free
+        if len(flights) >= WORKERS + MAX_QUEUE:
+            raise HTTPException(status_code=503, detail="Server is at capacity, please retry shortly.")
+        loop = asyncio.get_running_loop()
+        pipeline = loop.run_in_executor(
+            executor, rag.run_agent, request.query, request.chat_history,
+            request.profile or None, request.session_id, request.shards,
+        )
+        task = flights.start(key, pipeline)
+
+    try:
+        result = await asyncio.wait_for(asyncio.shield(task), timeout=REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Query did not finish within {REQUEST_TIMEOUT:g}s.")
+    return QueryResponse(output=result.get("output", ""), type=result.get("type", "error"))
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok" if all(warm.values()) else "warming",
+        "index_generation": {shard: current_generation(root) for shard, root in list_shards(rag.DB_DIR).items()},
+        "models": dict(warm),
+        "workers": WORKERS,
+        "in_flight": len(flights),
+        "queue_limit": MAX_QUEUE,
+        "coalesced_total": flights.coalesced,
+    }
+
+
+@app.get("/stats")
+async def stats():
+    """Per-intent latency, token spend and model choice, for tuning the routing table."""
+    return {
+        "routes": rag.MODEL_ROUTES,
+        "tiers": rag.MODEL_TIERS,
+        "intents": rag.get_routing_stats(),
+        "shards": rag.get_shard_stats(),
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # RAG_SERVER_PROCESSES > 1 forks that many server processes, each with its own worker pool
+    # and its own session working sets (follow-ups then need sticky routing by session_id)
+    uvicorn.run(
+        "src.server:app",
+        host=os.getenv("RAG_SERVER_HOST", "0.0.0.0"),
+        port=int(os.getenv("RAG_SERVER_PORT", "8000")),
+        workers=int(os.getenv("RAG_SERVER_PROCESSES", "1")),
+    )
@@ -1,19 +1,35 @@
 import os
 import hashlib
-import shutil
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from dotenv import load_dotenv
+from src.calibration import calibrate_store, save_calibration
+from src.dedup import deduplicate_chunks
+from src.embedding_server import load_embeddings
+from src.extractors import is_supported, load_documents, report_extraction_stats
+from src.generations import (
+    DEFAULT_SHARD,
+    current_generation_dir,
+    discard_generation,
+    list_shards,
+    new_generation_dir,
+    publish_generation,
+    shard_root,
+    unpublish_generation,
+)
+from src.ivfpq import IVFPQStore, is_ivfpq_generation
+from src.profiling import profile_run, stage
 
 # Load environment variables
 load_dotenv()
 
+# "chroma" (HNSW, default) or "ivfpq" (compressed IVF-PQ for very large corpora)
+VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma")
+
 
 def _get_documents_fingerprint(documents_dir: str) -> str:
     """Create a fingerprint of the documents directory based on filenames, sizes, and modification times."""
-    pdf_files = sorted([f for f in os.listdir(documents_dir) if f.endswith(".pdf")])
+    pdf_files = sorted([f for f in os.listdir(documents_dir) if is_supported(f)])
     if not pdf_files:
         return "empty"
     fingerprint_data = []
@@ -25,10 +41,24 @@ def _get_documents_fingerprint(documents_dir: str) -> str:
     return hashlib.md5("|".join(fingerprint_data).encode()).hexdigest()
 
 
-def ingest_documents(db_dir: str = "chroma_db", documents_dir: str = "documents"):
+def _validate_generation(vector_db, expected_chunks: int):
+    """Sanity-check a freshly built generation before it is published."""
+    stored = vector_db.count() if isinstance(vector_db, IVFPQStore) else vector_db._collection.count()
+    if stored != expected_chunks:
+        raise RuntimeError(f"Index validation failed: expected {expected_chunks} chunks, found {stored}.")
+    if expected_chunks and not vector_db.similarity_search("test", k=1):
+        raise RuntimeError("Index validation failed: probe query returned no results.")
+
+
+def ingest_documents(db_dir: str = "chroma_db", documents_dir: str = "documents", profile: bool = None, shards: list = None):
     """
     Loads PDFs, splits them into chunks, and creates a ChromaDB vector store.
     Re-ingests automatically if documents have changed since last ingestion.
+    Each build goes into a new generation directory that is only published
+    once it validates, so running processes keep serving the previous index.
+    Set profile=True (or RAG_PROFILE) to write a CPU/memory profile of the run.
+    Each subdirectory of documents_dir is indexed as its own shard; pass `shards`
+    to rebuild only some of them.
     """
     # Use absolute paths relative to project root
     if not os.path.isabs(db_dir):
@@ -36,44 +66,85 @@ def ingest_documents(db_dir: str = "chroma_db", documents_dir: str = "documents"
     if not os.path.isabs(documents_dir):
         documents_dir = os.path.join(os.getcwd(), documents_dir)
 
+    discovered_shards = _get_document_shards(documents_dir)
+    document_shards = discovered_shards
+    if shards is not None:
+        document_shards = {name: path for name, path in discovered_shards.items() if name in shards}
+
+    with profile_run("ingest", enabled=profile):
+        # A published shard whose documents are gone (deleted, or moved into a subfolder)
+        # would keep serving stale chunks next to their new copies, so stop serving it
+        for shard in list_shards(db_dir):
+            if shard not in discovered_shards and (shards is None or shard in shards):
+                print(f"Shard '{shard}' has no documents any more. Unpublishing it.")
+                unpublish_generation(shard_root(db_dir, shard))
+
+        # Each shard has its own fingerprint and generations, so unchanged shards are skipped
+        for shard, shard_documents_dir in document_shards.items():
+            if len(document_shards) > 1:
+                print(f"--- Shard: {shard} ---")
+            with stage(f"shard:{shard}"):
+                _ingest_shard(shard_root(db_dir, shard), shard_documents_dir)
+
+
+def _get_document_shards(documents_dir: str) -> dict:
+    """Map shard name -> documents directory.
+    Files directly in documents_dir form the default shard; each subdirectory
+    (e.g. one per team or document set) that contains documents is its own shard."""
+    shards = {DEFAULT_SHARD: documents_dir}
+    for name in sorted(os.listdir(documents_dir)):
+        path = os.path.join(documents_dir, name)
+        if os.path.isdir(path) and not name.startswith(".") and any(is_supported(f) for f in os.listdir(path)):
+            shards[name] = path
+    if len(shards) > 1 and not any(is_supported(f) for f in os.listdir(documents_dir)):
+        del shards[DEFAULT_SHARD]
+    return shards
+
+
+def _unpublish_if_live(db_dir: str, live_dir: str):
+    """Stop serving an index whose documents are all gone, rather than leaving stale chunks live."""
+    if live_dir is not None:
+        print("Unpublishing the previous index, whose documents no longer exist.")
+        unpublish_generation(db_dir)
+
+
+def _ingest_shard(db_dir: str, documents_dir: str):
+    """Build and publish a new index generation for one shard if its documents changed."""
     print(f"Checking for ChromaDB at: {db_dir}")
 
     current_fingerprint = _get_documents_fingerprint(documents_dir)
-    fingerprint_file = os.path.join(db_dir, ".docs_fingerprint")
 
-    # Check if DB exists and documents haven't changed
-    if os.path.exists(db_dir) and os.path.exists(os.path.join(db_dir, "chroma.sqlite3")):
+    # Check if a published generation exists and documents haven't changed
+    live_dir = current_generation_dir(db_dir)
+    if live_dir is not None:
+        fingerprint_file = os.path.join(live_dir, ".docs_fingerprint")
         if os.path.exists(fingerprint_file):
             with open(fingerprint_file, "r") as f:
                 saved_fingerprint = f.read().strip()
-            if saved_fingerprint == current_fingerprint:
+            same_backend = is_ivfpq_generation(live_dir) == (VECTOR_BACKEND == "ivfpq")
+            if saved_fingerprint == current_fingerprint and same_backend:
                 print("ChromaDB is up-to-date. Skipping ingestion.")
                 return
+            if not same_backend:
+                print(f"Switching vector backend to {VECTOR_BACKEND}. Building a new index generation...")
             else:
-                print("Documents have changed since last ingestion. Rebuilding ChromaDB...")
-                shutil.rmtree(db_dir)
+                print("Documents have changed since last ingestion. Building a new index generation...")
         else:
             # No fingerprint file means we can't verify — re-ingest to be safe
-            print("No fingerprint found. Rebuilding ChromaDB to ensure consistency...")
-            shutil.rmtree(db_dir)
+            print("No fingerprint found. Building a new index generation to ensure consistency...")
 
-    os.makedirs(db_dir, exist_ok=True)
     print(f"Ingesting documents from: {documents_dir}")
-    print(f"Creating ChromaDB at: {db_dir}")
-
-    documents = []
-    for filename in os.listdir(documents_dir):
-        if filename.endswith(".pdf"):
-            file_path = os.path.join(documents_dir, filename)
-            loader = PyPDFLoader(file_path)
-            loaded_docs = loader.load()
-            for doc in loaded_docs:
-                print(f"Processing: {filename}")
-                doc.metadata["source"] = filename
-            documents.extend(loaded_docs)
+
+    # Page text comes from the pluggable extractors and is cached by file hash,
+    # so changing the chunking below never re-parses a PDF
+    extraction_stats = {}
+    with stage("extract"):
+        documents = load_documents(documents_dir, extraction_stats)
+    report_extraction_stats(extraction_stats)
 
     if not documents:
         print("No documents found to ingest. Please add PDFs to the 'documents/' directory.")
+        _unpublish_if_live(db_dir, live_dir)
         return
 
     # Split documents into chunks for embedding with better overlap for context
@@ -82,20 +153,52 @@ def ingest_documents(db_dir: str = "chroma_db", documents_dir: str = "documents"
         chunk_overlap=150,
         separators=["\n\n", "\n", ". ", " ", ""]
     )
-    splits = text_splitter.split_documents(documents)
+    with stage("split"):
+        splits = text_splitter.split_documents(documents)
+    if not splits:
+        print("No text could be extracted from the documents (image-only PDFs?). Nothing to index.")
+        _unpublish_if_live(db_dir, live_dir)
+        return
 
-    # Use a sentence-transformer model for embeddings
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    # Collapse near-identical chunks (revised PDFs, boilerplate) before paying to embed them
+    if os.getenv("RAG_DEDUP", "1") != "0":
+        with stage("dedup"):
+            splits = deduplicate_chunks(splits)
 
-    # Create and persist the vector store
-    Chroma.from_documents(
-        documents=splits,
-        embedding=embeddings,
-        persist_directory=db_dir
-    )
+    # Use a sentence-transformer model for embeddings
+    embeddings = load_embeddings("all-MiniLM-L6-v2")
+
+    # Build into a fresh generation; the live index stays untouched until publish
+    generation_dir = new_generation_dir(db_dir, current_fingerprint)
+    print(f"Creating {VECTOR_BACKEND} index at: {generation_dir}")
+    store_cls = IVFPQStore if VECTOR_BACKEND == "ivfpq" else Chroma
+    try:
+        with stage("embed_and_index"):
+            vector_db = store_cls.from_documents(
+                documents=splits,
+                embedding=embeddings,
+                persist_directory=generation_dir
+            )
+        with stage("validate"):
+            _validate_generation(vector_db, len(splits))
+    except Exception:
+        discard_generation(generation_dir)
+        raise
+
+    # Per-corpus relevance threshold; without one retrieval falls back to the default
+    with stage("calibrate"):
+        try:
+            calibration = calibrate_store(vector_db, embeddings)
+        except Exception as e:
+            print(f"Calibration failed, using the default relevance threshold: {e}")
+            calibration = None
+    if calibration is not None:
+        save_calibration(generation_dir, calibration)
 
     # Save fingerprint so we can detect changes next time
-    with open(fingerprint_file, "w") as f:
+    with open(os.path.join(generation_dir, ".docs_fingerprint"), "w") as f:
         f.write(current_fingerprint)
 
+    publish_generation(db_dir, generation_dir)
+
     print(f"Documents ingested successfully! ({len(splits)} chunks from {len(set(d.metadata.get('source') for d in documents))} files)")
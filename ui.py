@@ -2,6 +2,7 @@ import streamlit as st
 import os
 import sys
 import time
+import uuid
 from dotenv import load_dotenv
 
 # MUST be the first Streamlit command
@@ -17,7 +18,7 @@ PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from src.agentic_rag_assistant import run_agent
+from src.agentic_rag_assistant import clear_session, run_agent
 from src.utils import ingest_documents
 
 load_dotenv()
@@ -344,6 +345,8 @@ if "db_ready" not in st.session_state:
     st.session_state.db_ready = False
 if "total_queries" not in st.session_state:
     st.session_state.total_queries = 0
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 # ── DB setup ──────────────────────────────────────────────────────────────────
 @st.cache_resource(show_spinner=False)
@@ -434,6 +437,7 @@ with st.sidebar:
     st.markdown('<div class="sidebar-section-title">Actions</div>', unsafe_allow_html=True)
     if st.button("🗑️  Clear conversation"):
         st.session_state.messages = []
+        clear_session(st.session_state.session_id)
         st.rerun()
 
     st.markdown('<div style="margin-top:0.4rem"></div>', unsafe_allow_html=True)
@@ -552,7 +556,11 @@ with col_main:
 
         with st.spinner(""):
             try:
-                response = run_agent(user_prompt, chat_history=st.session_state.messages)
+                response = run_agent(
+                    user_prompt,
+                    chat_history=st.session_state.messages,
+                    session_id=st.session_state.session_id,
+                )
                 output     = response.get("output", "")
                 agent_type = response.get("type", "conversational")
             except Exception as e: